@@ -7,6 +7,7 @@ Module for loading and saving.
 Functions:
 
 - read_data
+- project_coords
 - merge_geometry
 - spatialise
 - geojsonify
@@ -18,15 +19,25 @@ Functions:
 """
 
 from pathlib import Path
+from operator import itemgetter
 import json
 
 import requests
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import fiona
+import shapely
 from shapely.geometry import LineString, Polygon, MultiPolygon
+from pyproj import CRS, Transformer
 
-from openelec import EPSG4326, EPSG102022
+from openelec import EPSG102022
+
+# Parsed once, rather than from the definitions on every use
+CRS_WGS84 = CRS.from_epsg(4326)
+CRS_AEA = CRS.from_proj4(EPSG102022)
+TO_PROJECTED = Transformer.from_crs(CRS_WGS84, CRS_AEA, always_xy=True)
+TO_WGS84 = Transformer.from_crs(CRS_AEA, CRS_WGS84, always_xy=True)
 
 
 def read_data(data):
@@ -51,23 +62,50 @@ def read_data(data):
             data = Path(data)
 
     if isinstance(data, dict):
-        targets = gpd.GeoDataFrame.from_features(data, crs=EPSG4326)
+        targets = gpd.GeoDataFrame.from_features(data, crs=CRS_WGS84)
 
     if isinstance(data, Path):
         targets = gpd.read_file(data)
 
     targets = targets.dropna(subset=["geometry"])
 
-    if "area" not in targets.columns:
-        # raise ValueError("An 'area' column is requred")
-        proj = targets.to_crs(EPSG102022)["geometry"]
-        targets["area"] = proj.area
-        targets["x"] = proj.centroid.x
-        targets["y"] = proj.centroid.y
+    # the rest of the model works from lat/lon
+    if targets.crs is not None and not targets.crs.equals(
+        CRS_WGS84, ignore_axis_order=True
+    ):
+        targets = targets.to_crs(CRS_WGS84)
+
+    # projected centroids are needed by the network and for the model means
+    if not {"area", "x", "y"}.issubset(targets.columns):
+        # only the raw coordinates are projected, in a single call
+        proj = shapely.transform(targets.geometry.to_numpy(), project_coords)
+        if "area" not in targets.columns:
+            targets["area"] = shapely.area(proj)
+        centroids = shapely.centroid(proj)
+        targets["x"] = shapely.get_x(centroids)
+        targets["y"] = shapely.get_y(centroids)
 
     return targets
 
 
+def project_coords(coords):
+    """
+    Project an array of lon/lat coordinates to EPSG102022.
+
+    Parameters
+    ----------
+    coords : ndarray
+        Array of shape (n, 2) of longitude and latitude.
+
+    Returns
+    -------
+    projected : ndarray
+        Array of shape (n, 2) of projected x and y in metres.
+    """
+
+    return np.column_stack(TO_PROJECTED.transform(coords[:, 0], coords[:, 1]))
+
+
 def merge_geometry(results, geometry, columns=None):
     """
     Merge results from modelling with an original input geometry,
@@ -89,10 +127,12 @@ def merge_geometry(results, geometry, columns=None):
         Results with geometry.
     """
 
-    results_df = pd.DataFrame(results)
-
     if columns:
-        results_df = results_df[columns]
+        # only the wanted fields are pulled out of the dicts, so the
+        # per-node lists of arcs never become an object column
+        results_df = pd.DataFrame(
+            {col: [result[col] for result in results] for col in columns}
+        )
 
         geom_columns = geometry.columns
         drop_columns = []
@@ -101,10 +141,17 @@ def merge_geometry(results, geometry, columns=None):
                 drop_columns.append(col)
         geometry = geometry.drop(columns=drop_columns)
 
+    else:
+        results_df = pd.DataFrame(results)
+
     if len(results_df) > len(geometry):
         results_df.index = results_df.index - 1  # to get rid of pv point
 
-    spatial = geometry.merge(results_df, how="left", left_index=True, right_index=True)
+    # Column assignment aligns on the index, equivalent to a left merge
+    # but without going through the join machinery
+    spatial = geometry.copy()
+    for col in results_df.columns:
+        spatial[col] = results_df[col]
 
     return spatial
 
@@ -116,8 +163,9 @@ def spatialise(results, type="line"):
 
     Parameters
     ----------
-    results : list of dicts
+    results : list of dicts or DataFrame
         An output from the modelling.
+        The index of a DataFrame is kept.
     type : str, optional (default 'line'.)
         What type of geometry it is.
         (Currently only implemented for 'line').
@@ -131,15 +179,16 @@ def spatialise(results, type="line"):
     results_df = pd.DataFrame(results)
 
     if type == "line":
-        geometry = [
-            LineString([(arc["xs"], arc["ys"]), (arc["xe"], arc["ye"])])
-            for arc in results
-        ]
+        # convert the end points to lat/lon as plain coordinates
+        # and build all the lines in one call from an (n, 2, 2) array
+        coords = results_df[["xs", "ys", "xe", "ye"]].to_numpy(dtype=float)
+        coords = coords.reshape(-1, 2)
+        coords = np.column_stack(TO_WGS84.transform(coords[:, 0], coords[:, 1]))
+        geometry = shapely.linestrings(coords.reshape(-1, 2, 2))
     else:
         raise NotImplementedError("Only implemented for type==line.")
 
-    spatial = gpd.GeoDataFrame(results_df, crs=EPSG102022, geometry=geometry)
-    spatial = spatial.to_crs(EPSG4326)
+    spatial = gpd.GeoDataFrame(results_df, crs=CRS_WGS84, geometry=geometry)
 
     return spatial
 
@@ -147,6 +196,7 @@ def spatialise(results, type="line"):
 def geojsonify(gdf, property_cols=[]):
     """
     Convert GeoDataFrame to GeoJSON that can be supplied to JavaScript.
+    Missing property values are written as 0.
 
     Parameters
     ----------
@@ -169,14 +219,23 @@ def geojsonify(gdf, property_cols=[]):
         A GeoJSON representation that can be parsed by standard JSON readers.
     """
 
+    if property_cols is None:
+        property_cols = []
+
     geojson = {"type": "FeatureCollection", "features": []}
-    gdf.fillna(value=0)
 
-    for _, row in gdf.iterrows():
+    # iterate over plain columns rather than building a Series per row
+    # missing values are filled once for the whole frame, as NaN isn't valid JSON
+    # with no columns to_dict would give no rows at all, dropping every feature
+    if property_cols:
+        rows = gdf[property_cols].fillna(value=0).to_dict(orient="records")
+    else:
+        rows = [{}] * len(gdf)
+    for geom, row in zip(gdf.geometry, rows):
         geojson["features"].append(
             {
                 "type": "Feature",
-                "geometry": geometry(row["geometry"]),
+                "geometry": geometry(geom),
                 "properties": properties(row, property_cols),
             }
         )
@@ -230,7 +289,7 @@ def properties(row, property_cols):
 
     Parameters
     ----------
-    row: pandas.Series
+    row: dict or pandas.Series
         A single row from a GeoDataFrame.
     property_cols: list
         List of column names to be added.
@@ -305,6 +364,8 @@ def json2geojson(items):
         As a GeoJSON.
     """
 
+    lon_lat = itemgetter("lon", "lat")
+
     geojson = {
         "type": "FeatureCollection",
         "features": [
@@ -313,12 +374,7 @@ def json2geojson(items):
                 "properties": {},
                 "geometry": {
                     "type": "Polygon",
-                    "coordinates": [
-                        [
-                            [point["lon"], point["lat"]]
-                            for point in reversed(feature["geometry"])
-                        ]
-                    ],
+                    "coordinates": [list(map(lon_lat, feature["geometry"][::-1]))],
                 },
             }
             for feature in items
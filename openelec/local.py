@@ -3,12 +3,11 @@ local module for openelec
 Tool designed to take a small village and estimate the optimum connections,
 based on a PV installation location and economic data.
 
-Includes LocalModel class and calculate_profit function.
+Includes LocalModel class and subtree_profit function.
 """
 
 import numpy as np
-import numpy_financial as npf
-
+import pandas as pd
 
 from .model import Model
 from . import conv
@@ -42,6 +41,9 @@ class LocalModel(Model):
         self.targets = self.targets.loc[self.targets["area"] > min_area]
         self.targets = self.targets.assign(marg_dist=0, conn=0)
 
+        # fixed from here on, so only summed once for all parameter sets
+        self.total_area = self.targets["area"].sum()
+
     def connect_targets(self, origin=None):
         """
         Create an MST connecting the target features.
@@ -65,11 +67,13 @@ class LocalModel(Model):
         Convert all model output to GeoDataFrames.
         """
 
-        self.network_out = conv.spatialise(self.network, type="line")
-
+        # Filter before spatialising so that only these are reprojected
         # TODO this should happen automatically somewhere else
-        self.network_out = self.network_out.loc[self.network_out["enabled"] == 1]
-        self.network_out = self.network_out.drop(labels="existing", axis="columns")
+        arcs = pd.DataFrame(self.network)
+        arcs = arcs.loc[arcs["enabled"] == 1]
+        arcs = arcs.drop(labels="existing", axis="columns")
+
+        self.network_out = conv.spatialise(arcs, type="line")
 
         self.targets_out = conv.merge_geometry(
             self.nodes, self.targets, columns=["conn", "marg_dist"]
@@ -129,12 +133,20 @@ class LocalModel(Model):
         # 130 is based on MTF numbers, should use a real demand curve
         self.demand_per_person_kw_peak = self.demand / (4 * 30)
         self.gen_size_kw = (
-            self.targets["area"].sum()
-            * self.num_people_per_m2
-            * self.demand_per_person_kw_peak
+            self.total_area * self.num_people_per_m2 * self.demand_per_person_kw_peak
         )
         self.cost_gen = self.gen_size_kw * self.gen_cost
 
+        # Cash flows are -capex in the first year and then a constant
+        # income - opex for the remaining years, so NPV is that constant
+        # times the discount factors of those years, summed in closed form
+        if self.discount_rate == 0:
+            self.annuity_factor = self.years - 1
+        else:
+            self.annuity_factor = (
+                1 - (1 + self.discount_rate) ** -(self.years - 1)
+            ) / self.discount_rate
+
     def model(self, target_coverage=None):
         """
         Run the model with the given economic parameters and
@@ -160,43 +172,89 @@ class LocalModel(Model):
         best_npv = None
         total_arcs = len(self.network)
 
+        # One array per field, built once for all passes
+        # Walks index plain lists, which is faster than indexing
+        # NumPy arrays one element at a time from Python
+        end_nodes, arc_enabled, arcs_indptr, arcs_indices = network.network_arrays(
+            self.network, self.nodes
+        )
+        arc_ne = end_nodes.tolist()
+        arc_enabled = arc_enabled.tolist()
+        arcs_indptr = arcs_indptr.tolist()
+        arcs_indices = arcs_indices.tolist()
+
+        # Each node's own cost and income don't change between passes
+        marg_dist = np.array([node["marg_dist"] for node in self.nodes])
+        area = np.array([node["area"] for node in self.nodes])
+        node_cost = (self.cost_wire * marg_dist + self.cost_connection).tolist()
+        node_income = (
+            area * self.num_people_per_m2 * self.demand * self.tariff
+        ).tolist()
+
+        # cost and income of the subtree below every node, in one walk
+        # disabling an arc removes exactly the subtree below its end node
+        sub_cost, sub_income, parent = subtree_profit(
+            arc_ne,
+            arc_enabled,
+            node_cost,
+            node_income,
+            arcs_indptr,
+            arcs_indices,
+            index=0,
+        )
+
+        sub_cost = np.array(sub_cost)
+        sub_income = np.array(sub_income)
+
         while True:
+            # every candidate cut at once, as if that arc were disabled
+            # nodes that aren't reached have an empty subtree
+            cost = sub_cost[0] - sub_cost[end_nodes]
+            income_per_month = sub_income[0] - sub_income[end_nodes]
+
+            capex = self.cost_gen + cost
+            opex = self.opex_ratio * capex
+            income = income_per_month * 12
+
+            npv = (income - opex) * self.annuity_factor - capex
+
+            # the first of the most profitable, if it beats the best so far
             found = False
-            for arc in self.network:
-                # use a recursive function to calculate profitability
-                # this should all be done in a temporary network variable
-                # and indicate that this arc should be treated as if disabled
-                self.network, self.nodes, cost, income_per_month = calculate_profit(
-                    self.network,
-                    self.nodes,
-                    index=0,
-                    disabled_arc_index=arc["i"],
-                    cost=0,
-                    income_per_month=0,
-                    cost_wire=self.cost_wire,
-                    cost_connection=self.cost_connection,
-                    num_people_per_m2=self.num_people_per_m2,
-                    demand=self.demand,
-                    tariff=self.tariff,
-                )
-
-                capex = self.cost_gen + cost
-                opex = self.opex_ratio * capex
-                income = income_per_month * 12
-
-                flows = np.ones(self.years) * (income - opex)
-                flows[0] = -capex
-                npv = npf.npv(self.discount_rate, flows)
-
-                # check if this is the most profitable yet
-                if best_npv is None or (npv > best_npv):
+            if total_arcs > 0:
+                arc_index = int(np.argmax(npv))
+                if best_npv is None or (npv[arc_index] > best_npv):
                     found = True
-                    best_npv = npv
-                    best_npv_index = arc["i"]
+                    best_npv = npv[arc_index]
+                    best_npv_index = arc_index
 
             if found:
                 # disable that arc
                 self.network[best_npv_index]["enabled"] = 0
+                arc_enabled[best_npv_index] = 0
+
+                # rather than walking the whole network again, only the
+                # nodes above the cut lose its subtree
+                cut = arc_ne[best_npv_index]
+                above = []
+                index = parent[cut]
+                while index is not None:
+                    above.append(index)
+                    index = parent[index]
+                sub_cost[above] -= sub_cost[cut]
+                sub_income[above] -= sub_income[cut]
+
+                # and the nodes below it can no longer be reached
+                below = []
+                stack = [cut]
+                while stack:
+                    index = stack.pop()
+                    below.append(index)
+                    parent[index] = None
+                    for pos in range(arcs_indptr[index], arcs_indptr[index + 1]):
+                        if arc_enabled[arcs_indices[pos]]:
+                            stack.append(arc_ne[arcs_indices[pos]])
+                sub_cost[below] = 0
+                sub_income[below] = 0
 
             # now repeat the above steps for the whole network again
             # until we go through without finding a more profitable setup
@@ -205,10 +263,8 @@ class LocalModel(Model):
                 if target_coverage is None:
                     break
                 else:
-                    actual_coverage = (
-                        len([arc for arc in self.network if arc["enabled"] == 1])
-                        / total_arcs
-                    )
+                    # the flags are kept in step with the arc dicts
+                    actual_coverage = sum(arc_enabled) / total_arcs
                     if actual_coverage <= target_coverage:
                         break
 
@@ -225,28 +281,24 @@ class LocalModel(Model):
             Dict of summary results.
         """
 
-        count_nodes = 0
-        income_per_month = 0
-        gen_size_kw = 0
-        for node in self.nodes:
-            if node["conn"] == 1:
-                count_nodes += 1
-                income_per_month += (
-                    node["area"] * self.num_people_per_m2 * self.demand * self.tariff
-                )
-                gen_size_kw += (
-                    node["area"]
-                    * self.num_people_per_m2
-                    * self.demand_per_person_kw_peak
-                )
+        # masks and sums over whole arrays rather than accumulating per node
+        conn = np.array([node["conn"] == 1 for node in self.nodes], dtype=bool)
+        area = np.array([node["area"] for node in self.nodes], dtype=float)
+        count_nodes = int(conn.sum())
+        area_connected = area[conn].sum()
+        income_per_month = (
+            area_connected * self.num_people_per_m2 * self.demand * self.tariff
+        )
+        gen_size_kw = (
+            area_connected * self.num_people_per_m2 * self.demand_per_person_kw_peak
+        )
 
         if self.origin:
             count_nodes -= 1  # so we don't count the generator
 
-        total_length = 0.0
-        for arc in self.network:
-            if arc["enabled"] == 1:
-                total_length += arc["len"]
+        enabled = np.array([arc["enabled"] == 1 for arc in self.network], dtype=bool)
+        length = np.array([arc["len"] for arc in self.network], dtype=float)
+        total_length = length[enabled].sum()
 
         capex = (
             gen_size_kw * self.gen_cost
@@ -256,9 +308,7 @@ class LocalModel(Model):
         opex = self.opex_ratio * capex
         income = income_per_month * 12
 
-        flows = np.ones(self.years) * (income - opex)
-        flows[0] = -capex
-        npv = npf.npv(self.discount_rate, flows)
+        npv = (income - opex) * self.annuity_factor - capex
 
         self.results = {
             "connected": count_nodes,
@@ -273,57 +323,63 @@ class LocalModel(Model):
         return self.results
 
 
-def calculate_profit(
-    network,
-    nodes,
-    index,
-    disabled_arc_index,
-    cost,
-    income_per_month,
-    cost_wire,
-    cost_connection,
-    num_people_per_m2,
-    demand,
-    tariff,
+def subtree_profit(
+    arc_ne, arc_enabled, node_cost, node_income, arcs_indptr, arcs_indices, index
 ):
     """
-    Here we recurse through the network and calculate profit,
-    starting with all arcs that connect to the index node,
-    and get the end-nodes for those arcs
-    calculate profit on those nodes, and then recurse!
-    disabled_arc should be treated as if disabled
+    Walk downstream from the index node through the enabled arcs,
+    and sum the cost and income of the subtree below every node reached.
+    Cutting the arc into a node loses exactly that node's subtree,
+    so this replaces a separate walk for every arc that might be cut.
 
     Parameters
     ----------
-    network, nodes : list of dicts
-        Current state of both.
+    arc_ne, arc_enabled : sequences
+        End node and enabled flag of each arc.
+    node_cost, node_income : sequences
+        Capital cost (wire and connection) and monthly income of each node.
+    arcs_indptr, arcs_indices : sequences
+        CSR layout of the arcs leaving each node, from network_arrays.
     index : int
-        Current index.
-    disabled_arc_index : int
-        Arc that is currently disabled.
-    cost etc : all other parameters
+        Node to start from.
+
+    Returns
+    -------
+    sub_cost : list
+        Capital cost of the subtree below each node, including the node.
+        Zero for nodes that aren't reached.
+    sub_income : list
+        Monthly income of the subtree below each node, likewise.
+    parent : list
+        The node upstream of each node reached, None for the start node
+        and for nodes that aren't reached.
     """
 
-    # first calculate the profitability of thise node?
-    cost += cost_wire * nodes[index]["marg_dist"] + cost_connection
-    income_per_month += nodes[index]["area"] * num_people_per_m2 * demand * tariff
-
-    connected_arcs = [network[arc_index] for arc_index in nodes[index]["arcs"]]
-    for arc in connected_arcs:
-        if arc["enabled"] == 1 and arc["i"] != disabled_arc_index:
-            if arc["ns"] == index:
-                network, nodes, cost, income_per_month = calculate_profit(
-                    network,
-                    nodes,
-                    index=arc["ne"],
-                    disabled_arc_index=disabled_arc_index,
-                    cost=cost,
-                    income_per_month=income_per_month,
-                    cost_wire=cost_wire,
-                    cost_connection=cost_connection,
-                    num_people_per_m2=num_people_per_m2,
-                    demand=demand,
-                    tariff=tariff,
-                )
-
-    return network, nodes, cost, income_per_month
+    num_nodes = len(node_cost)
+    sub_cost = [0] * num_nodes
+    sub_income = [0] * num_nodes
+    parent = [None] * num_nodes
+
+    order = []
+    stack = [index]
+    while stack:
+        index = stack.pop()
+        order.append(index)
+
+        # first the profitability of this node on its own
+        sub_cost[index] = node_cost[index]
+        sub_income[index] = node_income[index]
+
+        for pos in range(arcs_indptr[index], arcs_indptr[index + 1]):
+            arc_index = arcs_indices[pos]
+            if arc_enabled[arc_index]:
+                parent[arc_ne[arc_index]] = index
+                stack.append(arc_ne[arc_index])
+
+    # in reverse, every node comes after all of its descendants
+    # so its subtree is complete by the time it is added to its parent
+    for index in reversed(order[1:]):
+        sub_cost[parent[index]] += sub_cost[index]
+        sub_income[parent[index]] += sub_income[index]
+
+    return sub_cost, sub_income, parent
@@ -55,10 +55,14 @@ class Model:
             self.targets = self.targets.sort_values(sort_by, ascending=False)
 
         self.baseline(**kwargs)
-        self.x_mean = self.targets.geometry.centroid.x.mean()
-        self.y_mean = self.targets.geometry.centroid.y.mean()
 
-        self.targets = self.targets.reset_index().drop(columns=["index"])
+        # Take the mean of the projected centroids (already calculated
+        # as x and y) and convert that single point back to lat/lon
+        self.x_mean, self.y_mean = conv.TO_WGS84.transform(
+            self.targets["x"].mean(), self.targets["y"].mean()
+        )
+
+        self.targets = self.targets.reset_index(drop=True)
 
     def baseline(self):
         raise NotImplementedError("This method should always be over-ridden.")
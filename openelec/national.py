@@ -175,58 +175,53 @@ class NationalModel(Model):
             self.model()
 
             # first remove un-enabled arcs from nodes
+            # each arc is only listed on its two end nodes
             for arc in self.network:
                 if arc["enabled"] == 0:
-                    for node in self.nodes:
-                        if arc["i"] in node["arcs"]:
-                            node["arcs"].remove(arc["i"])
+                    self.nodes[arc["ns"]]["arcs"].remove(arc["i"])
+                    self.nodes[arc["ne"]]["arcs"].remove(arc["i"])
 
             # starting from the ends, new grid is pruned
             # starting with most expensive
             # pruned are set as off-grid, next algorithm will determine which
             # to keep
-            new_grid_pop = sum(
-                n["pop"]
-                for n in self.nodes
-                if n["conn_start"] == 0 and n["conn_end"] == 1
+            # The node values needed are held as arrays indexed by node["i"]
+            pop = np.array([n["pop"] for n in self.nodes])
+            cost_per_person = np.array([n["grid_cost"] for n in self.nodes]) / pop
+            num_arcs = np.array([len(n["arcs"]) for n in self.nodes])
+            new_grid = np.array(
+                [n["conn_start"] == 0 and n["conn_end"] == 1 for n in self.nodes],
+                dtype=bool,
             )
-            target_new_grid_pop = 1.1 * new_grid_pop * s / steps
 
-            while True:
-                current_new_grid_pop = sum(
-                    n["pop"]
-                    for n in self.nodes
-                    if n["conn_start"] == 0 and n["conn_end"] == 1
-                )
-                if current_new_grid_pop < target_new_grid_pop:
+            target_new_grid_pop = 1.1 * pop[new_grid].sum() * s / steps
+
+            while pop[new_grid].sum() >= target_new_grid_pop:
+                # Find the most expensive node at the end of a branch
+                # (node 0 is never pruned)
+                ends_cost = np.where(new_grid & (num_arcs == 1), cost_per_person, 0)
+                ends_cost[0] = 0
+                index_most_expensive_node = int(ends_cost.argmax())
+
+                # Stop if none is found, otherwise this would loop forever
+                if ends_cost[index_most_expensive_node] <= 0:
                     break
 
-                # Find the most expensive node
-                index_most_expensive_node = None
-                most_expensive = 0
-                for node in self.nodes:
-                    if node["conn_start"] == 0 and node["conn_end"] == 1:
-                        if len(node["arcs"]) == 1:
-                            cost_per_person = node["grid_cost"] / node["pop"]
-                            if cost_per_person > most_expensive:
-                                most_expensive = cost_per_person
-                                index_most_expensive_node = node["i"]
-
-                # If one is found
-                if index_most_expensive_node:
-                    # Remove the most expensive node
-                    self.nodes[index_most_expensive_node]["conn_end"] = 0
-
-                    # Disable the arc that came to it
-                    arc_index = self.nodes[index_most_expensive_node]["arcs"][0]
-                    self.network[arc_index]["enabled"] = 0
-
-                    # And remove that arc from the node that preceded it
-                    if self.network[arc_index]["ne"] == index_most_expensive_node:
-                        prev_node = self.network[arc_index]["ns"]
-                    else:
-                        prev_node = self.network[arc_index]["ne"]
-                    self.nodes[prev_node]["arcs"].remove(arc_index)
+                # Remove the most expensive node
+                self.nodes[index_most_expensive_node]["conn_end"] = 0
+                new_grid[index_most_expensive_node] = False
+
+                # Disable the arc that came to it
+                arc_index = self.nodes[index_most_expensive_node]["arcs"][0]
+                self.network[arc_index]["enabled"] = 0
+
+                # And remove that arc from the node that preceded it
+                if self.network[arc_index]["ne"] == index_most_expensive_node:
+                    prev_node = self.network[arc_index]["ns"]
+                else:
+                    prev_node = self.network[arc_index]["ne"]
+                self.nodes[prev_node]["arcs"].remove(arc_index)
+                num_arcs[prev_node] -= 1
 
             # Convert results to GeoDataFrames
             self.spatialise()
@@ -331,30 +326,32 @@ class NationalModel(Model):
             Output from model.
         """
 
-        self.network_out = conv.spatialise(self.network, type="line")
+        arcs = pd.DataFrame(self.network)
 
         # Only keep new network lines created by model
+        # Done before spatialising so that only these are reprojected
         # TODO this should happen automatically somewhere else
         if filter_network:
-            self.network_out = self.network_out.loc[
-                self.network_out["existing"] == 0
-            ].loc[self.network_out["enabled"] == 1]
+            arcs = arcs.loc[(arcs["existing"] == 0) & (arcs["enabled"] == 1)]
+
+        self.network_out = conv.spatialise(arcs, type="line")
 
         self.targets_out = conv.merge_geometry(
             self.nodes, self.targets, columns=["i", "conn_end", "og_cost", "grid_cost"]
         )
 
         # Assign target type based on model results
-        self.targets_out["type"] = ""
-        self.targets_out.loc[
-            (self.targets_out["conn_end"] == 1) & (self.targets_out["conn_start"] == 1),
-            "type",
-        ] = "densify"
-        self.targets_out.loc[
-            (self.targets_out["conn_end"] == 1) & (self.targets_out["conn_start"] == 0),
-            "type",
-        ] = "grid"
-        self.targets_out.loc[self.targets_out["conn_end"] == 0, "type"] = "offgrid"
+        conn_start = self.targets_out["conn_start"].to_numpy()
+        conn_end = self.targets_out["conn_end"].to_numpy()
+        self.targets_out["type"] = np.select(
+            [
+                (conn_end == 1) & (conn_start == 1),
+                (conn_end == 1) & (conn_start == 0),
+                conn_end == 0,
+            ],
+            ["densify", "grid", "offgrid"],
+            default="",
+        )
 
     def initial_access(self):
         """
@@ -408,11 +405,22 @@ class NationalModel(Model):
 
         # First calcaulte the off-grid cost for each unconnected settlement
         # TODO incorporate SHS and other options
+        # The local (MV, LV, transformer and connection) part of the grid
+        # cost only depends on the node, so it is also calculated once here
+        local_grid_cost = {}
         for node in self.nodes:
             if node["conn_start"] == 0:
-                _, local_lv, _ = util.calc_lv(
+                local_mv, local_lv, transformers = util.calc_lv(
                     node["pop"], node["demand"], self.people_per_hh, node["area"]
                 )
+                lv_cost = (
+                    local_mv * self.grid_mv_cost
+                    + local_lv * self.grid_lv_cost
+                    + transformers * self.grid_trans_cost
+                )
+                conn_cost = self.grid_conn_cost * node["pop"] / self.people_per_hh
+                local_grid_cost[node["i"]] = lv_cost + conn_cost
+
                 # 130 4hours/day*30days/month based on MTF numbers
                 # TODO use a demand curve
                 demand_peak = node["demand"] / (4 * 30)
@@ -426,49 +434,36 @@ class NationalModel(Model):
 
         # keep looping until no further connections are added
         while True:
-            to_be_connected = []
+            # candidates keyed by the order they were added, and for each
+            # node, the candidates that include it
+            to_be_connected = {}
+            claimed = {}
+            count = 0
 
             for node in self.nodes:
                 # only start searches from currently connected nodes
                 if node["conn_end"] == 1:
+                    # bound once here, as node is reused by the loops below
+                    node_index = node["i"]
 
-                    connected_arcs = [
-                        self.network[arc_index] for arc_index in node["arcs"]
-                    ]
-                    for arc in connected_arcs:
+                    for arc_index in node["arcs"]:
+                        arc = self.network[arc_index]
                         if arc["enabled"] == 0:
-                            goto = "ne" if arc["ns"] == node["i"] else "ns"
+                            goto = "ne" if arc["ns"] == node_index else "ns"
 
                             # function call a bit of a mess with all
                             # the c_ and b_ values
-                            self.network, self.nodes, b_demand, b_length, b_nodes, b_arcs = find_best(
+                            b_demand, b_length, mg_cost, b_nodes, b_arcs = find_best(
                                 self.network, self.nodes, arc[goto], arc["i"]
                             )
 
-                            # calculate the mg and grid costs of the
-                            # resultant configuration
+                            # calculate the grid costs of the resultant
+                            # configuration (mg_cost is summed by find_best)
                             best_nodes = [self.nodes[i] for i in b_nodes]
                             best_arcs = [self.network[i] for i in b_arcs]
-                            mg_cost = sum([node["og_cost"] for node in best_nodes])
 
                             for node in best_nodes:
-                                local_mv, local_lv, transformers = util.calc_lv(
-                                    node["pop"],
-                                    node["demand"],
-                                    self.people_per_hh,
-                                    node["area"],
-                                )
-                                lv_cost = (
-                                    local_mv * self.grid_mv_cost
-                                    + local_lv * self.grid_lv_cost
-                                    + transformers * self.grid_trans_cost
-                                )
-                                conn_cost = (
-                                    self.grid_conn_cost
-                                    * node["pop"]
-                                    / self.people_per_hh
-                                )
-                                self.nodes[node["i"]]["grid_cost"] = lv_cost + conn_cost
+                                node["grid_cost"] = local_grid_cost[node["i"]]
 
                             # The network direction comes before the optimisation
                             # So it can be either ns or ne that is valid.
@@ -490,25 +485,34 @@ class NationalModel(Model):
 
                             if grid_cost < mg_cost:
                                 # check if any nodes are already in to_be_connected
+                                # only the earliest added overlap is compared
                                 add = True
-                                for index, item in enumerate(to_be_connected):
-                                    if set(b_nodes).intersection(item[1]):
-                                        if b_demand / b_length < item[0]:
-                                            del to_be_connected[index]
-                                        else:
-                                            # if the existing one is better,
-                                            # we don't add the new one
-                                            add = False
-                                        break
+                                overlaps = [
+                                    key for i in b_nodes for key in claimed.get(i, ())
+                                ]
+                                if overlaps:
+                                    key = min(overlaps)
+                                    if b_demand / b_length < to_be_connected[key][0]:
+                                        for i in to_be_connected.pop(key)[1]:
+                                            claimed[i].remove(key)
+                                    else:
+                                        # if the existing one is better,
+                                        # we don't add the new one
+                                        add = False
 
                                 if add:
-                                    to_be_connected.append(
-                                        (b_demand / b_length, b_nodes, b_arcs)
+                                    to_be_connected[count] = (
+                                        b_demand / b_length,
+                                        b_nodes,
+                                        b_arcs,
                                     )
+                                    for i in b_nodes:
+                                        claimed.setdefault(i, set()).add(count)
+                                    count += 1
 
             # mark all to_be_connected as actually connected
             if len(to_be_connected) >= 1:
-                for item in to_be_connected:
+                for item in to_be_connected.values():
                     for node in item[1]:
                         self.nodes[node]["conn_end"] = 1
                     for arc in item[2]:
@@ -572,66 +576,90 @@ class NationalModel(Model):
         return self.results
 
 
-def find_best(
-    network,
-    nodes,
-    index,
-    prev_arc,
-    b_demand=0,
-    b_length=1e-9,
-    b_nodes=[],
-    b_arcs=[],
-    c_demand=0,
-    c_length=1e-9,
-    c_nodes=[],
-    c_arcs=[],
-):
+def find_best(network, nodes, index, prev_arc):
     """
-    This function recurses the network, bringing current c_ values with it.
-    These aren't returned, so are left untouched side-branch explorations.
-    The b_ values are returned, and updated when a better configuration found.
-    Thus these will remember the best solution including all side meanders.
+    Search out from index (reached along prev_arc) through unconnected nodes
+    and disabled arcs, for the path with the highest demand per length.
+
+    The network is walked depth-first with an explicit stack rather than
+    recursion. Each frame carries the current c_ values for its path,
+    so side-branch explorations are left untouched, while the b_ values
+    are updated whenever a better path is found.
+    The off-grid cost of the path is summed along the way, so the caller
+    doesn't need to sum it again.
+
+    Parameters
+    ----------
+    network, nodes : list of dicts
+        Current state of both, only read.
+    index : int
+        Node to start from.
+    prev_arc : int
+        Arc that leads to index.
+
+    Returns
+    -------
+    b_demand, b_length, b_og_cost : float
+        Total demand, line length and off-grid cost of the best path.
+    b_nodes, b_arcs : list of int
+        Nodes and arcs making up the best path.
     """
 
-    # TODO add defaults to parameters
-
-    # Because otherwise references to the same lists are carried around
-    # But I found any real cases where it makes a difference...
-    c_nodes = c_nodes.copy()
-    c_arcs = c_arcs.copy()
-
-    # don't do anything with already connected nodes
-    if nodes[index]["conn_end"] == 0:
-        c_demand += nodes[index]["demand"]
-        c_length += network[prev_arc]["len"]
-        c_nodes = c_nodes[:] + [index]
-        c_arcs = c_arcs[:] + [prev_arc]
-
-        if c_demand / c_length > b_demand / b_length:
-            b_demand = c_demand
-            b_length = c_length
-            b_nodes[:] = c_nodes[:]
-            b_arcs[:] = c_arcs[:]
+    b_demand = 0
+    b_length = 1e-9
+    b_og_cost = 0
+    b_nodes = []
+    b_arcs = []
+
+    # the path to the node at the top of the stack
+    c_nodes = []
+    c_arcs = []
+
+    # each frame holds the node's remaining arcs and the c_ values up to it
+    stack = []
+    next_node = (index, prev_arc, 0, 1e-9, 0)
+
+    while True:
+        if next_node:
+            index, prev_arc, c_demand, c_length, c_og_cost = next_node
+            next_node = None
+            node = nodes[index]
+
+            # don't do anything with already connected nodes
+            if node["conn_end"] == 0:
+                c_demand += node["demand"]
+                c_length += network[prev_arc]["len"]
+                c_og_cost += node["og_cost"]
+                c_nodes.append(index)
+                c_arcs.append(prev_arc)
+
+                if c_demand / c_length > b_demand / b_length:
+                    b_demand = c_demand
+                    b_length = c_length
+                    b_og_cost = c_og_cost
+                    b_nodes = c_nodes[:]
+                    b_arcs = c_arcs[:]
+
+                stack.append(
+                    (iter(node["arcs"]), index, prev_arc, c_demand, c_length, c_og_cost)
+                )
 
-        connected_arcs = [network[arc_index] for arc_index in nodes[index]["arcs"]]
-        for arc in connected_arcs:
-            if arc["enabled"] == 0 and arc["i"] != prev_arc:
+        if not stack:
+            break
 
+        arcs, index, prev_arc, c_demand, c_length, c_og_cost = stack[-1]
+        for arc_index in arcs:
+            arc = network[arc_index]
+            if arc["enabled"] == 0 and arc_index != prev_arc:
                 # make sure we look at the other end of the arc
                 goto = "ne" if arc["ns"] == index else "ns"
-                network, nodes, b_demand, b_length, b_nodes, b_arcs = find_best(
-                    network,
-                    nodes,
-                    arc[goto],
-                    arc["i"],
-                    b_demand,
-                    b_length,
-                    b_nodes,
-                    b_arcs,
-                    c_demand,
-                    c_length,
-                    c_nodes,
-                    c_arcs,
-                )
+                next_node = (arc[goto], arc_index, c_demand, c_length, c_og_cost)
+                break
+
+        # all arcs from this node explored, so step back along the path
+        else:
+            stack.pop()
+            c_nodes.pop()
+            c_arcs.pop()
 
-    return network, nodes, b_demand, b_length, b_nodes, b_arcs
+    return b_demand, b_length, b_og_cost, b_nodes, b_arcs
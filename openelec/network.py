@@ -12,19 +12,15 @@ Functions:
 - add_origin
 - remove_existing
 - direct_network
+- network_arrays
 """
 
-from math import sqrt
-
 import numpy as np
-import pandas as pd
-import geopandas as gpd
-from sklearn.neighbors import kneighbors_graph
 from scipy.sparse.csgraph import minimum_spanning_tree
 from scipy import sparse
-from shapely.geometry import Point
+from scipy.spatial import cKDTree, Delaunay
 
-from openelec import EPSG4326, EPSG102022
+from . import conv
 
 
 def create_network(
@@ -63,44 +59,59 @@ def create_network(
     # mountains etc
 
     points = targets[columns]
-    if origin:
-        points = add_origin(points, origin)
 
     # This point and line data is then copied into two arrays,
     # called network and nodes, containing lines and clusters.
     # Each element represents a single cluster or joining arc,
     # and has data within describing the coordinates and more.
-    nodes = []
-    for index, row in points.iterrows():
-        row_dict = row.to_dict()
-        row_dict["i"] = index
-        row_dict["arcs"] = []
-        nodes.append(row_dict)
-
-    mst_points = points[["x", "y"]].values
+    nodes = points.to_dict(orient="records")
+    mst_points = points[["x", "y"]].to_numpy()
+    indices = points.index
+    if origin:
+        nodes, mst_points = add_origin(nodes, mst_points, origin)
+        indices = range(len(nodes))
+
     start_points, end_points, nodes_conn = spanning_tree(mst_points, approximate=True)
 
-    network = []
-    for i, (s, e, n) in enumerate(zip(start_points, end_points, nodes_conn)):
-        xs = int(s[0])
-        ys = int(s[1])
-        xe = int(e[0])
-        ye = int(e[1])
-        length = int(sqrt((xe - xs) ** 2 + (ye - ys) ** 2))
+    # The arcs at each node, grouped in one sort rather than appended one
+    # at a time, in arc order within each node
+    endpoints = nodes_conn.T.ravel()
+    arc_ids = np.tile(np.arange(len(nodes_conn)), 2)
+    order = np.lexsort((arc_ids, endpoints))
+    node_arcs = arc_ids[order].tolist()
+    indptr = np.zeros(len(nodes) + 1, dtype=int)
+    np.cumsum(np.bincount(endpoints, minlength=len(nodes)), out=indptr[1:])
+    indptr = indptr.tolist()
+
+    for index, node, start, end in zip(indices, nodes, indptr[:-1], indptr[1:]):
+        node["i"] = index
+        node["arcs"] = node_arcs[start:end]
+
+    # Coordinates and lengths for all arcs at once, rather than per arc
+    start_points = start_points.astype(int)
+    end_points = end_points.astype(int)
+    deltas = end_points - start_points
+    lengths = np.hypot(deltas[:, 0], deltas[:, 1]).astype(int)
 
+    network = []
+    for i, (s, e, n, length) in enumerate(
+        zip(
+            start_points.tolist(),
+            end_points.tolist(),
+            nodes_conn.tolist(),
+            lengths.tolist(),
+        )
+    ):
         ns = n[0]
         ne = n[1]
 
-        nodes[ns]["arcs"].append(i)
-        nodes[ne]["arcs"].append(i)
-
         network.append(
             {
                 "i": i,
-                "xs": xs,
-                "ys": ys,
-                "xe": xe,
-                "ye": ye,
+                "xs": s[0],
+                "ys": s[1],
+                "xe": e[0],
+                "ye": e[1],
                 "ns": ns,
                 "ne": ne,
                 "len": length,
@@ -129,67 +140,111 @@ def spanning_tree(X, approximate=False):
     X: array_like
         2D array of shape (n_sample, 2) containing the x- and y-coordinates
         of the points.
+    approximate: bool, optional (default False.)
+        Only used if the points can't be triangulated, in which case
+        only the 50 nearest neighbours of each point are considered.
 
     Returns
     -------
-    x_coords, y_coords : ndarrays
-        the x and y coordinates for plotting the graph.  They are of size
-        [2, n_links], and can be visualized using
-        ``plt.plot(x_coords, y_coords, '-k')``
+    start_points, end_points : ndarrays
+        The x and y coordinates of the start and end of each link.
+        Each is of shape (n_links, 2).
+    nodes_connected : ndarray
+        The indices into X of the start and end of each link,
+        of shape (n_links, 2).
     """
 
-    if approximate:
-        n_neighbors = 50
-
-    else:
-        n_neighbors = len(X) - 1
+    X = np.asarray(X)
+    if X.ndim != 2 or X.shape[1] != 2:
+        raise ValueError("shape of X should be (n_samples, 2)")
 
-    n_neighbors = min(n_neighbors, len(X) - 1)
-    if n_neighbors < 2:
+    n_samples = len(X)
+    if n_samples < 3:
         raise ValueError("Need at least three sample points")
 
-    G = kneighbors_graph(X, n_neighbors=n_neighbors, mode="distance")
-    full_tree = minimum_spanning_tree(G, overwrite=True)
+    if np.linalg.matrix_rank(X - X.mean(axis=0)) == 2:
+        # The Euclidean MST is a subgraph of the Delaunay triangulation,
+        # so its edges (about 3N of them) are the only candidates needed
+        tri = Delaunay(X)
+        simplices = tri.simplices
+        edges = np.concatenate(
+            (simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [2, 0]])
+        )
+        # Points too close to another to be triangulated are joined to it
+        edges = np.concatenate((edges, tri.coplanar[:, [0, 2]]))
+        # Each edge must only appear once, as duplicates would be summed
+        edges = np.unique(np.sort(edges, axis=1), axis=0)
+        rows = edges[:, 0]
+        cols = edges[:, 1]
 
-    X = np.asarray(X)
-    if X.ndim != 2 or X.shape[1] != 2:
-        raise ValueError("shape of X should be (n_samples, 2)")
+    else:
+        # Degenerate cases such as all points on a line can't be triangulated
+        # so use a k-nearest-neighbour graph instead
+        # The first neighbour returned for each point is the point itself
+        if approximate:
+            n_neighbors = min(50, n_samples - 1)
+        else:
+            n_neighbors = n_samples - 1
+        _, idx = cKDTree(X).query(X, k=n_neighbors + 1)
+        rows = np.repeat(np.arange(n_samples), n_neighbors)
+        cols = idx[:, 1:].ravel()
+
+    # The tree only depends on the order of the weights, so squared
+    # distances do as well and skip the square roots
+    # (create_network measures the real lengths of the chosen links)
+    deltas = X[cols] - X[rows]
+    G = sparse.csr_matrix(
+        (np.einsum("ij,ij->i", deltas, deltas), (rows, cols)),
+        shape=(n_samples, n_samples),
+    )
+    full_tree = minimum_spanning_tree(G, overwrite=True)
 
     coo = sparse.coo_matrix(full_tree)
-    A = X[coo.row].T
-    B = X[coo.col].T
-
-    start_points = [(Ax, Ay) for Ax, Ay in zip(A[0], A[1])]
-    end_points = [(Bx, By) for Bx, By in zip(B[0], B[1])]
-    nodes_connected = [(s, e) for s, e in zip(coo.row, coo.col)]
+    start_points = X[coo.row]
+    end_points = X[coo.col]
+    nodes_connected = np.column_stack((coo.row, coo.col))
 
     return start_points, end_points, nodes_connected
 
 
-def add_origin(points, origin):
+def add_origin(nodes, mst_points, origin):
     """
     If origin not specified, the model defaults to using index 0
     as the 'main' point. Thus targets should already have been sorted
     by population/area with largest first.
+
+    Otherwise the origin is put in front of the other points, so that it
+    becomes index 0 instead.
+
+    Parameters
+    ----------
+    nodes : list of dicts
+        The node representations.
+    mst_points : ndarray
+        Array of shape (n, 2) of the projected node coordinates.
+    origin : tuple of two floats
+        Location of the origin, of the form (latitude, longitude).
+
+    Returns
+    -------
+    nodes : list of dicts
+        The nodes with the origin first, with zero for all its other fields.
+    mst_points : ndarray
+        The coordinates with the origin's first.
     """
 
     gen_lat = float(origin[0])
     gen_lng = float(origin[1])
-    pv_point = gpd.GeoDataFrame(crs=EPSG4326, geometry=[Point([gen_lng, gen_lat])])
-    pv_point_projected = pv_point.to_crs(EPSG102022)
-    pv_point_df = [
-        {
-            "x": float(pv_point_projected.geometry.x),
-            "y": float(pv_point_projected.geometry.y),
-            "area": 0,
-        }
-    ]
-    points = pd.concat(
-        [pd.DataFrame(pv_point_df), points], ignore_index=True, sort=False
-    )
-    points = points.fillna(value=0)
+    # a single coordinate, so project it directly rather than through a frame
+    pv_x, pv_y = conv.TO_PROJECTED.transform(gen_lng, gen_lat)
+
+    # prepend to the list and array rather than concatenating frames
+    pv_node = dict.fromkeys(nodes[0] if nodes else [], 0)
+    pv_node.update(x=pv_x, y=pv_y, area=0)
+    nodes = [pv_node] + nodes
+    mst_points = np.concatenate(([[pv_x, pv_y]], mst_points))
 
-    return points
+    return nodes, mst_points
 
 
 def remove_existing(network, nodes):
@@ -199,17 +254,16 @@ def remove_existing(network, nodes):
 
     for node in nodes:
         if node["conn_start"] == 0:
-            connected_arcs = [network[arc_index] for arc_index in node["arcs"]]
-            for arc in connected_arcs:
-                network[arc["i"]]["existing"] = 0
-                network[arc["i"]]["enabled"] = 0
+            for arc_index in node["arcs"]:
+                network[arc_index]["existing"] = 0
+                network[arc_index]["enabled"] = 0
 
     return network
 
 
-def direct_network(network, nodes, index, prev):
+def direct_network(network, nodes, index=0, prev=None):
     """
-    Recursive function to direct the network from the PV point outwards
+    Direct the network from the PV point outwards.
     We need to calculate the directionality of the network, starting from the
     PV location and reaching outwards to the furthest branches.
 
@@ -218,44 +272,82 @@ def direct_network(network, nodes, index, prev):
     'upstream' of it, and which is 'downstream'. We also tell each node which
     arcs (at least one, up to three or four?) it is connected to.
 
+    The tree is walked with an explicit stack rather than by recursion,
+    so long chains of buildings can't hit the recursion limit.
+
     Parameters
     ----------
     network: list of dicts
         Containing the arc representations.
     nodes: list of dicts
         Containing the building node representations.
-    index: int
-        Current node index that we're looking at.
+    index: int, optional (default 0.)
+        Node index to start from.
+    prev: int, optional
+        Arc index that leads to the start node, which is not followed.
 
     Returns
-    -------`
-    network: list of lists
-        Nearby network directed for current node.
-    nodes: list of list
-        The nodes object.
+    -------
+    network: list of dicts
+        The network with all arcs directed away from the start node.
     """
 
-    connected_arcs = nodes[index]["arcs"]
-    for arc_index in connected_arcs:
-        if arc_index == prev:
-            continue
+    stack = [(index, prev)]
+    while stack:
+        index, prev = stack.pop()
+        for arc_index in nodes[index]["arcs"]:
+            if arc_index == prev:
+                continue
+
+            arc = network[arc_index]
+            if not arc["ns"] == index:
+                arc["ne"] = arc["ns"]
+                arc["ns"] = index
+
+                xs_new = arc["xe"]
+                ys_new = arc["ye"]
+                arc["xe"] = arc["xs"]
+                arc["ye"] = arc["ys"]
+                arc["xs"] = xs_new
+                arc["ys"] = ys_new
+
+            # and investigate downstream from this node
+            stack.append((arc["ne"], arc_index))
+
+    # only needs doing once all arcs have their final direction
+    for arc in network:
+        nodes[arc["ne"]]["marg_dist"] = arc["len"]
+
+    return network
+
 
-        arc = network[arc_index]
-        if not arc["ns"] == index:
-            arc["ne"] = arc["ns"]
-            arc["ns"] = index
+def network_arrays(network, nodes):
+    """
+    Struct-of-arrays view of a directed network, with one array per field
+    rather than one dict per arc.
 
-            xs_new = arc["xe"]
-            ys_new = arc["ye"]
-            arc["xe"] = arc["xs"]
-            arc["ye"] = arc["ys"]
-            arc["xs"] = xs_new
-            arc["ys"] = ys_new
+    Parameters
+    ----------
+    network: list of dicts
+        Containing the directed arc representations.
+    nodes: list of dicts
+        Containing the node representations.
 
-        # and investigate downstream from this node
-        network = direct_network(network, nodes, arc["ne"], arc_index)
+    Returns
+    -------
+    arc_ne, arc_enabled : ndarrays
+        End node and enabled flag of each arc.
+    arcs_indptr, arcs_indices : ndarrays
+        CSR layout of the arcs leaving each node, so the arcs leaving node i
+        are arcs_indices[arcs_indptr[i]:arcs_indptr[i + 1]], in index order.
+    """
 
-    for arc in network:
-        nodes[arc["ne"]]["marg_dist"] = arc["len"]
+    arc_ns = np.array([arc["ns"] for arc in network], dtype=int)
+    arc_ne = np.array([arc["ne"] for arc in network], dtype=int)
+    arc_enabled = np.array([arc["enabled"] for arc in network], dtype=int)
 
-    return network
+    arcs_indices = np.argsort(arc_ns, kind="stable")
+    arcs_indptr = np.zeros(len(nodes) + 1, dtype=int)
+    np.cumsum(np.bincount(arc_ns, minlength=len(nodes)), out=arcs_indptr[1:])
+
+    return arc_ne, arc_enabled, arcs_indptr, arcs_indices
@@ -63,19 +63,18 @@ def priority(
             ~clusters["travel"].between(travel_range[0], travel_range[1]), "consider"
         ] = 0
 
-    pop_max = clusters.loc[clusters["consider"] == 1, "pop"].max()
-    gdp_max = clusters.loc[clusters["consider"] == 1, "gdp"].max()
-    grid_max = clusters.loc[clusters["consider"] == 1, "grid"].max()
-
-    def get_score(row):
-        gdp_score = row["gdp"] / gdp_max
-        pop_score = row["pop"] / pop_max
-        grid_score = row["grid"] / grid_max
-
-        return gdp_score + pop_score + grid_score
+    considered = clusters.loc[clusters["consider"] == 1]
+    pop_max = considered["pop"].max()
+    gdp_max = considered["gdp"].max()
+    grid_max = considered["grid"].max()
 
+    # score each considered cluster on whole columns rather than row by row
     clusters["score"] = None
-    clusters.loc[clusters["consider"] == 1, "score"] = clusters.apply(get_score, axis=1)
+    clusters.loc[clusters["consider"] == 1, "score"] = (
+        considered["gdp"] / gdp_max
+        + considered["pop"] / pop_max
+        + considered["grid"] / grid_max
+    )
     max_score = clusters["score"].max()
     clusters["score"] = clusters["score"] / max_score
     summary = {"num-clusters": len(clusters.loc[clusters["consider"] == 1])}
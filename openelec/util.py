@@ -25,18 +25,22 @@ def connect_houses(network, nodes, index):
     now we need to tell the houses that aren't connected, that they aren't
     connected (or vice-versa)
 
-    Start from base, follow connection (similar to calculate_profit)
+    Start from base, follow connection (similar to subtree_profit)
     and swith node[6] to 1 wherever connected and only follow the paths
     of connected houses.
     """
 
-    # this node is connected
-    nodes[index]["conn"] = 1
+    stack = [index]
+    while stack:
+        index = stack.pop()
 
-    connected_arcs = [network[arc_index] for arc_index in nodes[index]["arcs"]]
-    for arc in connected_arcs:
-        if arc["enabled"] == 1 and arc["ns"] == index:
-            connect_houses(network, nodes, arc["ne"])
+        # this node is connected
+        nodes[index]["conn"] = 1
+
+        for arc_index in nodes[index]["arcs"]:
+            arc = network[arc_index]
+            if arc["enabled"] == 1 and arc["ns"] == index:
+                stack.append(arc["ne"])
 
     return network, nodes
 
@@ -48,9 +52,8 @@ def stranded_arcs(network, nodes):
 
     for node in nodes:
         if node["conn"] == 0:
-            connected_arcs = [network[arc_index] for arc_index in node["arcs"]]
-            for arc in connected_arcs:
-                arc["enabled"] = 0
+            for arc_index in node["arcs"]:
+                network[arc_index]["enabled"] = 0
 
     return network, nodes
 
@@ -19,14 +19,15 @@ setup(
     long_description_content_type='text/markdown',
     url='https://github.com/carderne/openelec',
     packages=['openelec'],
+    python_requires='>=3.8',
     install_requires=[
         'flask>=1.0.2',
         'numpy>=1.14.2',
         'pandas>=0.22.0',
-        'geopandas>=0.4.0',
-        'shapely>=1.6.4',
+        'geopandas>=0.12',
+        'shapely>=2.0',
         'scipy>=1.0.0',
-        'scikit-learn>=0.17.1',
+        'pyproj>=3.0',
     ],
     classifiers=[
         'Programming Language :: Python :: 3',